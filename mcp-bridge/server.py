@@ -3,16 +3,40 @@ FastMCP Bridge Server with Strands Agent (Async version using Quart)
 All MCP operations run in the SAME event loop as the web server.
 """
 import asyncio
+import concurrent.futures
+import functools
+import hashlib
+import inspect
+import logging
+import logging.handlers
 import os
 import json
 import platform
-from quart import Quart, request, jsonify
+import queue
+import threading
+import time
+import traceback
+from collections import OrderedDict
+import orjson
+from quart import Quart, Response, request, jsonify
 from fastmcp import Client
+from strands import Agent, tool as strands_tool
+from strands.models.openai import OpenAIModel
 from dotenv import load_dotenv
 
 # Load environment variables from .env
 load_dotenv()
 
+# Level-gated logging with formatting done off-thread: records go through a
+# QueueHandler so the event loop never blocks on stdout; lazy %s formatting
+# means suppressed levels (LOG_LEVEL=WARNING in production) cost nothing
+_log_queue = queue.SimpleQueue()
+log = logging.getLogger("mcp-bridge")
+log.setLevel(os.getenv('LOG_LEVEL', 'INFO'))
+log.addHandler(logging.handlers.QueueHandler(_log_queue))
+_log_listener = logging.handlers.QueueListener(_log_queue, logging.StreamHandler())
+_log_listener.start()
+
 app = Quart(__name__)
 
 @app.after_request
@@ -22,70 +46,646 @@ async def add_cors(response):
     response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
     return response
 
-# Global MCP client and tools cache
-mcp_client = None
+# Include formatted tracebacks in error responses — off unless MCP_DEBUG_TB=1.
+# Formatting a traceback walks the whole frame stack; under an error storm
+# that cost adds up, so it's opt-in.
+DEBUG_TB = os.getenv('MCP_DEBUG_TB') == '1'
+
+# One Client per MCP server so a hung server can't block the other
+mcp_clients = {}
 mcp_tools_cache = []
 
+# Public tool names carry the server prefix (drawio_..., aws_diagram_...),
+# matching what the combined client used to expose
+_SERVER_PREFIXES = {'drawio': 'drawio_', 'aws_diagram': 'aws_diagram_'}
+
+# Per-server events that wake the supervisor to reconnect
+_reconnect_events = {}
+
+# Precomputed routing: public tool name -> (server, native name), built at
+# list time so per-call routing is one dict lookup instead of prefix scans
+_tool_routes = {}
+
+# Result cache for tools whose output depends only on their arguments —
+# the agent calls these repeatedly within and across /chat sessions
+_CACHEABLE = {
+    'aws_diagram_list_icons',
+    'aws_diagram_get_diagram_examples',
+    'drawio_get-shape-categories',
+}
+_TOOL_CACHE = OrderedDict()  # (name, sorted-args json) -> (timestamp, result)
+_TOOL_CACHE_TTL = 300  # seconds
+_TOOL_CACHE_MAX = 256
+
+# Backpressure on tool calls: _TOOL_SEM bounds concurrent dispatches,
+# _QUEUE_SEM bounds how many callers may wait behind them
+_TOOL_SEM = asyncio.Semaphore(int(os.getenv('MCP_MAX_CONCURRENT', '5')))
+_QUEUE_SEM = asyncio.Semaphore(int(os.getenv('MCP_MAX_QUEUED', '10')))
+_tool_stats = {'active': 0, 'queued': 0, 'rejected': 0}
+
+
+class BridgeOverloadedError(Exception):
+    """Raised when the tool-call queue is full."""
+
+# Pre-serialized /tools payload, rebuilt only on (re)connect or explicit refresh
+_tools_json = None
+_tools_lock = asyncio.Lock()
+
+# Tool proxies prebuilt at connect time so /chat doesn't redo the reflection
+# work (signatures, docstrings, closures) on every request
+PREBUILT_DRAWIO_TOOLS = []
+PREBUILT_AWS_TOOLS = []
+
+# Event loop the MCP client lives on, captured at connect time
+_loop = None
+
+
+class McpBatcher:
+    """Coalesce tool calls issued within a short window and dispatch them
+    concurrently, collapsing N sequential stdio round-trips into one
+    wall-clock window."""
+
+    __slots__ = ('_queue', '_task')
+
+    BATCH_WINDOW = 0.02  # seconds to wait for more calls to coalesce
+    MAX_BATCH = 8
+
+    def __init__(self):
+        self._queue = asyncio.Queue()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._drain())
+
+    def submit(self, name, arguments):
+        """Queue a tool call from any thread; returns a concurrent.futures.Future."""
+        future = concurrent.futures.Future()
+        _loop.call_soon_threadsafe(self._queue.put_nowait, (name, arguments, future))
+        return future
+
+    async def _drain(self):
+        while True:
+            batch = [await self._queue.get()]
+            await asyncio.sleep(self.BATCH_WINDOW)
+            while len(batch) < self.MAX_BATCH and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            # Dispatch as a task so a slow batch can't stall the drain loop
+            asyncio.get_running_loop().create_task(self._dispatch(batch))
+
+    async def _dispatch(self, batch):
+        await asyncio.gather(*(self._invoke(n, a, f) for n, a, f in batch))
+
+    async def _invoke(self, name, arguments, future):
+        try:
+            # The timeout lives here, on the awaited side, so a hung call is
+            # actually cancelled and the backpressure semaphores it holds are
+            # released; the caller's future.result(61) is only a backstop
+            result = await asyncio.wait_for(
+                _call_mcp_tool_bounded(name, arguments),
+                timeout=60
+            )
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+
+batcher = McpBatcher()
+
+# Single dedicated thread for LLM-bound agent runs. Concentrating the
+# blocking work on one thread the OS can keep on one core avoids GIL
+# ping-pong between the bridge loop and a pool of agent threads.
+_llm_loop = asyncio.new_event_loop()
+
+
+def _run_llm_loop():
+    asyncio.set_event_loop(_llm_loop)
+    _llm_loop.run_forever()
+
+
+threading.Thread(target=_run_llm_loop, name="llm-worker", daemon=True).start()
+
+
+async def _run_on_llm_worker(fn):
+    """Run a blocking callable on the llm-worker thread, awaiting its result."""
+    async def _call():
+        return fn()
+    return await asyncio.wrap_future(
+        asyncio.run_coroutine_threadsafe(_call(), _llm_loop)
+    )
+
+
+# Bound queued chats so oversubscribed model clients can't OOM the bridge
+_CHAT_SEM = asyncio.Semaphore(16)
+
+# Reuse OpenAIModel instances per API key so the underlying HTTP client
+# keeps its keep-alive connections and TLS session across chats. LRU-capped:
+# the key is client-supplied, so without a bound a caller could pin an
+# unbounded number of models (each holding an HTTP client) in memory.
+_MODEL_CACHE = OrderedDict()
+_MODEL_CACHE_MAX = 32
+
+
+def _get_model(api_key):
+    key = hashlib.sha256(api_key.encode()).hexdigest()
+    model = _MODEL_CACHE.get(key)
+    if model is None:
+        model = OpenAIModel(
+            client_args={"api_key": api_key},
+            model_id="gpt-4o",
+        )
+        _MODEL_CACHE[key] = model
+    _MODEL_CACHE.move_to_end(key)
+    while len(_MODEL_CACHE) > _MODEL_CACHE_MAX:
+        _MODEL_CACHE.popitem(last=False)
+    return model
+
+
+@functools.lru_cache(maxsize=256)
+def _build_signature(schema_json):
+    """Parse a JSON schema into (inspect.Signature, Args docstring block).
+
+    Memoized on the schema's serialization in its original property
+    order — many tools share byte-identical schemas (the drawio_add-*
+    family), so each distinct schema is parsed once. Property order
+    matters: it defines the positional parameter order, and sorting it
+    can put a required parameter after an optional one, which
+    inspect.Signature rejects.
+    """
+    input_schema = json.loads(schema_json)
+    props = input_schema.get("properties", {})
+    required_params = input_schema.get("required", [])
+
+    parameters = []
+    for pname, pinfo in props.items():
+        json_type = pinfo.get("type", "string")
+        if not json_type and "anyOf" in pinfo:
+            for variant in pinfo["anyOf"]:
+                if variant.get("type") != "null":
+                    json_type = variant.get("type", "string")
+                    break
+
+        py_type = str
+        if json_type == "integer":
+            py_type = int
+        elif json_type == "number":
+            py_type = float
+        elif json_type == "boolean":
+            py_type = bool
+
+        default = inspect.Parameter.empty if pname in required_params else None
+        parameters.append(inspect.Parameter(
+            pname,
+            inspect.Parameter.POSITIONAL_OR_KEYWORD,
+            default=default,
+            annotation=py_type,
+        ))
+
+    signature = inspect.Signature(parameters, return_annotation=str)
+
+    param_docs = []
+    for pname, pinfo in props.items():
+        pdesc = pinfo.get("description", "")
+        if pdesc:
+            param_docs.append(f"    {pname}: {pdesc}")
+    doc_block = "\n".join(["\nArgs:"] + param_docs) if param_docs else ""
+    return signature, doc_block
+
+
+def make_tool_fn(name, desc, input_schema):
+    """Build a @tool-decorated proxy function for one MCP tool.
+
+    The proxy calls MCP on the bridge event loop; clients are resolved
+    per call so reconnects still work.
+    """
+    # Decided once at build time instead of two checks per call
+    force_no_timeout = name.startswith("aws_diagram") and platform.system() == "Windows"
+
+    def tool_fn(**kwargs) -> str:
+        """Proxy MCP tool call."""
+        filtered = {k: v for k, v in kwargs.items() if v is not None}
+        if force_no_timeout:
+            filtered["timeout"] = 0
+
+        log.info("🔧 Calling tool: %s", name)
+        log.debug("   Args: %.200s", filtered)
+        try:
+            # Submit to the batcher so concurrent calls share one dispatch
+            # window. The batcher's 60s wait_for is the real timeout (it can
+            # cancel the coroutine); this result() wait is just a backstop.
+            future = batcher.submit(name, filtered)
+            result = future.result(timeout=61)
+            serialized = serialize_mcp_result(result)
+            result_str = json.dumps(serialized) if not isinstance(serialized, str) else serialized
+            log.info("   ✅ Result: %.200s", result_str)
+            return result_str
+        except (asyncio.TimeoutError, concurrent.futures.TimeoutError):
+            log.warning("   ⏰ TIMEOUT: Tool '%s' timed out", name)
+            return json.dumps({"error": f"Tool '{name}' timed out."})
+        except Exception as e:
+            log.warning("   ❌ ERROR: Tool '%s' failed: %s", name, e)
+            return json.dumps({"error": f"Tool '{name}' failed: {str(e)}"})
+
+    # Signature and Args block come from the schema cache; only the
+    # description differs per tool
+    signature, doc_block = _build_signature(orjson.dumps(input_schema).decode())
+    tool_fn.__signature__ = signature
+    tool_fn.__name__ = name
+    tool_fn.__qualname__ = name
+    tool_fn.__doc__ = f"{desc}\n{doc_block}" if doc_block else desc
+
+    return strands_tool(name=name, description=desc)(tool_fn)
+
+
+def _build_tool_lists(tools):
+    """Construct tool proxies once and split them by target MCP server."""
+    global PREBUILT_DRAWIO_TOOLS, PREBUILT_AWS_TOOLS
+    drawio_tools = []
+    aws_tools = []
+    for t in tools:
+        schema = t.inputSchema if hasattr(t, 'inputSchema') else {}
+        fn = make_tool_fn(t.name, t.description or t.name, schema)
+        if t.name.startswith('drawio'):
+            drawio_tools.append(fn)
+        else:
+            aws_tools.append(fn)
+    # Local-only style lookup, answered in-process without an MCP round-trip
+    drawio_tools.append(get_aws_style)
+    PREBUILT_DRAWIO_TOOLS = drawio_tools
+    PREBUILT_AWS_TOOLS = aws_tools
+
+
+def _build_tools_json(tools):
+    """Serialize the tool list once so /tools can return a cached payload."""
+    return json.dumps({
+        'tools': [
+            {
+                'name': tool.name,
+                'description': tool.description,
+                'inputSchema': tool.inputSchema
+            }
+            for tool in tools
+        ]
+    })
+
+
+def _server_configs():
+    """Per-server MCP configs, instantiated as separate Clients."""
+    is_windows = platform.system() == "Windows"
+    npx_cmd = "npx.cmd" if is_windows else "npx"
+    drawio_port = os.getenv("DRAWIO_PORT", "3334")
+
+    return {
+        "drawio": {
+            "transport": "stdio",
+            "command": npx_cmd,
+            "args": ["-y", "--prefer-offline", "drawio-mcp-server", "-p", drawio_port]
+        },
+        "aws_diagram": {
+            "transport": "stdio",
+            "command": "python",
+            "args": ["aws_diagram_wrapper.py"],
+            "env": {"FASTMCP_LOG_LEVEL": "ERROR"}
+        }
+    }
+
+
+def _route_tool(tool_name):
+    """Resolve a public (prefixed) tool name to its client and native name."""
+    route = _tool_routes.get(tool_name)
+    if route is None:
+        # Not listed (yet) — fall back to prefix matching
+        for server, prefix in _SERVER_PREFIXES.items():
+            if tool_name.startswith(prefix):
+                route = (server, tool_name[len(prefix):])
+                break
+        else:
+            raise ValueError(f"Unknown tool: {tool_name}")
+    server, native_name = route
+    client = mcp_clients.get(server)
+    if client is None:
+        raise RuntimeError(f"MCP server '{server}' is not connected")
+    return server, client, native_name
+
+
+async def _call_mcp_tool(name, arguments, timeout=None):
+    """Route a tool call to the owning server's client.
+
+    Deterministic tools are served from an LRU cache with a TTL,
+    short-circuiting the stdio round-trip on a hit. When timeout is None
+    the caller is expected to bound the wait itself.
+    """
+    key = None
+    if name in _CACHEABLE:
+        key = (name, orjson.dumps(arguments, option=orjson.OPT_SORT_KEYS, default=str))
+        cached = _TOOL_CACHE.get(key)
+        if cached is not None and time.monotonic() - cached[0] < _TOOL_CACHE_TTL:
+            _TOOL_CACHE.move_to_end(key)
+            return cached[1]
+
+    server, client, native_name = _route_tool(name)
+    try:
+        coro = client.call_tool(native_name, arguments)
+        if timeout is not None:
+            result = await asyncio.wait_for(coro, timeout=timeout)
+        else:
+            result = await coro
+    except Exception:
+        # fastmcp stdio failures surface as anyio.BrokenResourceError /
+        # ClosedResourceError or McpError("Connection closed"), none of
+        # which subclass OSError — so instead of matching exception types,
+        # ask the client whether its transport is still alive
+        try:
+            alive = client.is_connected()
+        except Exception:
+            alive = False
+        if not alive:
+            _mark_disconnected(server)
+        raise
+
+    if key is not None:
+        _TOOL_CACHE[key] = (time.monotonic(), result)
+        _TOOL_CACHE.move_to_end(key)
+        while len(_TOOL_CACHE) > _TOOL_CACHE_MAX:
+            _TOOL_CACHE.popitem(last=False)
+    return result
+
+
+async def _call_mcp_tool_bounded(name, arguments, timeout=None):
+    """Apply backpressure: a bounded queue in front of a concurrency limit.
+
+    Rejects immediately (instead of queueing without bound) once the
+    queue is full, so slow tools surface as structured overload errors
+    rather than timeouts for everyone.
+    """
+    if _QUEUE_SEM.locked():
+        _tool_stats['rejected'] += 1
+        raise BridgeOverloadedError(f"Tool call '{name}' rejected: bridge overloaded")
+    async with _QUEUE_SEM:
+        _tool_stats['queued'] += 1
+        try:
+            await _TOOL_SEM.acquire()
+        finally:
+            _tool_stats['queued'] -= 1
+        _tool_stats['active'] += 1
+        try:
+            return await _call_mcp_tool(name, arguments, timeout=timeout)
+        finally:
+            _tool_stats['active'] -= 1
+            _TOOL_SEM.release()
+
+
+async def _list_all_tools():
+    """List tools from every server concurrently, applying the public name prefixes."""
+    global _tool_routes
+    servers = list(mcp_clients.items())
+    listings = await asyncio.gather(*(client.list_tools() for _, client in servers))
+    tools = []
+    routes = {}
+    for (server, _), listing in zip(servers, listings):
+        prefix = _SERVER_PREFIXES[server]
+        for t in listing:
+            routes[prefix + t.name] = (server, t.name)
+            tools.append(t.model_copy(update={'name': prefix + t.name}))
+    _tool_routes = routes
+    return tools
+
+
+async def _rebuild_tool_caches():
+    """Refresh the tool cache, the /tools payload and the prebuilt proxies."""
+    global mcp_tools_cache, _tools_json
+    tools = await _list_all_tools()
+    mcp_tools_cache = tools
+    _tools_json = _build_tools_json(tools)
+    _build_tool_lists(tools)
+
+
+def _mark_disconnected(server):
+    """Wake the supervisor so it reconnects this server."""
+    event = _reconnect_events.get(server)
+    if event is not None:
+        event.set()
+
+
+async def supervise(server):
+    """Reconnect a server's client with exponential backoff once flagged dead."""
+    event = _reconnect_events[server]
+    while True:
+        await event.wait()
+        event.clear()
+        backoff = 1
+        while True:
+            old = mcp_clients.pop(server, None)
+            if old is not None:
+                try:
+                    await old.__aexit__(None, None, None)
+                except Exception:
+                    pass
+            try:
+                client = Client({"mcpServers": {server: _server_configs()[server]}})
+                await client.__aenter__()
+                mcp_clients[server] = client
+                await _rebuild_tool_caches()
+                log.info("🔄 Reconnected MCP server '%s'", server)
+                break
+            except Exception as e:
+                log.warning("⚠️ Reconnect to '%s' failed: %s — retrying in %ss", server, e, backoff)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
 
 async def init_mcp():
-    """Initialize MCP client connection to Draw.io and AWS Diagram servers."""
-    global mcp_client, mcp_tools_cache
+    """Initialize MCP client connections to Draw.io and AWS Diagram servers."""
+    global _loop
     try:
-        is_windows = platform.system() == "Windows"
-        npx_cmd = "npx.cmd" if is_windows else "npx"
-        drawio_port = os.getenv("DRAWIO_PORT", "3334")
-
-        config = {
-            "mcpServers": {
-                "drawio": {
-                    "transport": "stdio",
-                    "command": npx_cmd,
-                    "args": ["-y", "drawio-mcp-server", "-p", drawio_port]
-                },
-                "aws_diagram": {
-                    "transport": "stdio",
-                    "command": "python",
-                    "args": ["aws_diagram_wrapper.py"],
-                    "env": {"FASTMCP_LOG_LEVEL": "ERROR"}
-                }
-            }
+        _loop = asyncio.get_running_loop()
+
+        # Connect both servers in parallel — startup cost is max(), not sum()
+        configs = _server_configs()
+        clients = {
+            server: Client({"mcpServers": {server: server_config}})
+            for server, server_config in configs.items()
         }
+        await asyncio.gather(*(client.__aenter__() for client in clients.values()))
 
-        mcp_client = Client(config)
-        await mcp_client.__aenter__()
+        for server, client in clients.items():
+            mcp_clients[server] = client
+            _reconnect_events[server] = asyncio.Event()
+            _loop.create_task(supervise(server))
 
         print("✅ Connected to MCP servers")
 
-        tools = await mcp_client.list_tools()
-        mcp_tools_cache = tools
-        print(f"📋 Available tools: {len(tools)} tools found")
-        for tool in tools:
+        # Warm list_tools on both servers right away (also forces their lazy
+        # import paths before the first real request)
+        await _rebuild_tool_caches()
+        batcher.start()
+        print(f"📋 Available tools: {len(mcp_tools_cache)} tools found")
+        for tool in mcp_tools_cache:
             print(f"   - {tool.name}")
 
     except Exception as e:
         print(f"❌ Failed to connect to MCP server: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("MCP connect failed")
         raise
 
 
+# Serialization strategy per concrete type, populated on first sight so the
+# hot path is one dict lookup instead of a chain of isinstance/hasattr probes
+_DISPATCH = {}
+
+
+def _serialize_list(obj):
+    # Fast-path the common MCP shape: a list of content objects with .text.
+    # Every element must qualify — mixed results (text + image) are valid
+    # and take the per-item path.
+    if obj and all(hasattr(o, 'text') and not hasattr(o, 'content') for o in obj):
+        return [o.text for o in obj]
+    return [serialize_mcp_result(item) for item in obj]
+
+
+def _serialize_dict(obj):
+    return {k: serialize_mcp_result(v) for k, v in obj.items()}
+
+
+def _serialize_handler_for(cls, obj):
+    """Pick the serialization strategy for a type (computed once per type)."""
+    if issubclass(cls, (str, int, float, bool)):
+        return lambda o: o
+    if issubclass(cls, list):
+        return _serialize_list
+    if issubclass(cls, dict):
+        return _serialize_dict
+    if hasattr(obj, 'content'):
+        return lambda o: serialize_mcp_result(o.content)
+    if hasattr(obj, 'text'):
+        return lambda o: o.text
+    if hasattr(obj, '__dict__'):
+        return lambda o: serialize_mcp_result(o.__dict__)
+    return str
+
+
 def serialize_mcp_result(obj):
     """Helper to convert MCP result objects into JSON serializable structures."""
     if obj is None:
         return None
-    if isinstance(obj, (str, int, float, bool)):
-        return obj
-    if isinstance(obj, list):
-        return [serialize_mcp_result(item) for item in obj]
-    if isinstance(obj, dict):
-        return {k: serialize_mcp_result(v) for k, v in obj.items()}
-    if hasattr(obj, 'content'):
-        return serialize_mcp_result(obj.content)
-    if hasattr(obj, 'text'):
-        return obj.text
-    if hasattr(obj, '__dict__'):
-        return serialize_mcp_result(obj.__dict__)
-    return str(obj)
+    cls = type(obj)
+    handler = _DISPATCH.get(cls)
+    if handler is None:
+        handler = _DISPATCH[cls] = _serialize_handler_for(cls, obj)
+    return handler(obj)
+
+
+# Draw.io mxgraph style strings per AWS component, kept out of the prompt
+# so each request only pays tokens for the components it mentions
+_AWS_STYLES = {
+    "User": "shape=mxgraph.aws4.user;verticalLabelPosition=bottom;align=center;verticalAlign=top;html=1;fontColor=#232F3E;fillColor=#D2D3D3;strokeColor=none;aspect=fixed;",
+    "EC2": "shape=mxgraph.aws4.resourceIcon;resIcon=mxgraph.aws4.ec2;fontColor=#232F3E;fillColor=#ED7100;strokeColor=#ffffff;verticalLabelPosition=bottom;verticalAlign=top;align=center;html=1;aspect=fixed;",
+    "RDS": "shape=mxgraph.aws4.resourceIcon;resIcon=mxgraph.aws4.rds;fontColor=#232F3E;fillColor=#3333FF;strokeColor=#ffffff;verticalLabelPosition=bottom;verticalAlign=top;align=center;html=1;aspect=fixed;",
+    "S3": "shape=mxgraph.aws4.resourceIcon;resIcon=mxgraph.aws4.s3;fontColor=#232F3E;fillColor=#009900;strokeColor=#ffffff;verticalLabelPosition=bottom;verticalAlign=top;align=center;html=1;aspect=fixed;",
+    "Lambda": "shape=mxgraph.aws4.resourceIcon;resIcon=mxgraph.aws4.lambda;fontColor=#232F3E;fillColor=#ED7100;strokeColor=#ffffff;verticalLabelPosition=bottom;verticalAlign=top;align=center;html=1;aspect=fixed;",
+    "API Gateway": "shape=mxgraph.aws4.resourceIcon;resIcon=mxgraph.aws4.api_gateway;fontColor=#232F3E;fillColor=#8C4FFF;strokeColor=#ffffff;verticalLabelPosition=bottom;verticalAlign=top;align=center;html=1;aspect=fixed;",
+    "Glue": "shape=mxgraph.aws4.resourceIcon;resIcon=mxgraph.aws4.glue;fontColor=#232F3E;fillColor=#8C4FFF;strokeColor=#ffffff;verticalLabelPosition=bottom;verticalAlign=top;align=center;html=1;aspect=fixed;",
+    "SNS": "shape=mxgraph.aws4.resourceIcon;resIcon=mxgraph.aws4.sns;fontColor=#232F3E;fillColor=#CC2264;strokeColor=#ffffff;verticalLabelPosition=bottom;verticalAlign=top;align=center;html=1;aspect=fixed;",
+    "SQS": "shape=mxgraph.aws4.resourceIcon;resIcon=mxgraph.aws4.sqs;fontColor=#232F3E;fillColor=#CC2264;strokeColor=#ffffff;verticalLabelPosition=bottom;verticalAlign=top;align=center;html=1;aspect=fixed;",
+    "CloudWatch": "shape=mxgraph.aws4.resourceIcon;resIcon=mxgraph.aws4.cloudwatch;fontColor=#232F3E;fillColor=#CC2264;strokeColor=#ffffff;verticalLabelPosition=bottom;verticalAlign=top;align=center;html=1;aspect=fixed;",
+    "DynamoDB": "shape=mxgraph.aws4.resourceIcon;resIcon=mxgraph.aws4.dynamodb;fontColor=#232F3E;fillColor=#3333FF;strokeColor=#ffffff;verticalLabelPosition=bottom;verticalAlign=top;align=center;html=1;aspect=fixed;",
+    "Step Functions": "shape=mxgraph.aws4.resourceIcon;resIcon=mxgraph.aws4.step_functions;fontColor=#232F3E;fillColor=#CC2264;strokeColor=#ffffff;verticalLabelPosition=bottom;verticalAlign=top;align=center;html=1;aspect=fixed;",
+    "Bedrock": "shape=mxgraph.aws4.resourceIcon;resIcon=mxgraph.aws4.bedrock;fontColor=#232F3E;fillColor=#01A88D;strokeColor=#ffffff;verticalLabelPosition=bottom;verticalAlign=top;align=center;html=1;aspect=fixed;",
+    "VPC": "shape=mxgraph.aws4.resourceIcon;resIcon=mxgraph.aws4.vpc;fontColor=#232F3E;fillColor=#8C4FFF;strokeColor=#ffffff;verticalLabelPosition=bottom;verticalAlign=top;align=center;html=1;aspect=fixed;",
+    "Route 53": "shape=mxgraph.aws4.resourceIcon;resIcon=mxgraph.aws4.route_53;fontColor=#232F3E;fillColor=#8C4FFF;strokeColor=#ffffff;verticalLabelPosition=bottom;verticalAlign=top;align=center;html=1;aspect=fixed;",
+    "Cognito": "shape=mxgraph.aws4.resourceIcon;resIcon=mxgraph.aws4.cognito;fontColor=#232F3E;fillColor=#DD344C;strokeColor=#ffffff;verticalLabelPosition=bottom;verticalAlign=top;align=center;html=1;aspect=fixed;",
+    "ECS": "shape=mxgraph.aws4.resourceIcon;resIcon=mxgraph.aws4.ecs;fontColor=#232F3E;fillColor=#ED7100;strokeColor=#ffffff;verticalLabelPosition=bottom;verticalAlign=top;align=center;html=1;aspect=fixed;",
+    "EKS": "shape=mxgraph.aws4.resourceIcon;resIcon=mxgraph.aws4.eks;fontColor=#232F3E;fillColor=#ED7100;strokeColor=#ffffff;verticalLabelPosition=bottom;verticalAlign=top;align=center;html=1;aspect=fixed;",
+    "KMS": "shape=mxgraph.aws4.resourceIcon;resIcon=mxgraph.aws4.kms;fontColor=#232F3E;fillColor=#DD344C;strokeColor=#ffffff;verticalLabelPosition=bottom;verticalAlign=top;align=center;html=1;aspect=fixed;",
+    "Kinesis": "shape=mxgraph.aws4.resourceIcon;resIcon=mxgraph.aws4.kinesis;fontColor=#232F3E;fillColor=#8C4FFF;strokeColor=#ffffff;verticalLabelPosition=bottom;verticalAlign=top;align=center;html=1;aspect=fixed;",
+    "Redshift": "shape=mxgraph.aws4.resourceIcon;resIcon=mxgraph.aws4.redshift;fontColor=#232F3E;fillColor=#3333FF;strokeColor=#ffffff;verticalLabelPosition=bottom;verticalAlign=top;align=center;html=1;aspect=fixed;",
+}
+
+# Inlined when the message doesn't name any known component
+_DEFAULT_STYLE_COMPONENTS = ("User", "EC2", "RDS", "S3", "Lambda", "API Gateway", "VPC")
+
+
+# ── System prompts (static, built once at import time) ──
+
+_PROMPT_PNG = """You are an expert diagram architect. The user wants a static PNG diagram generated via Python.
+You MUST use the aws_diagram tools (get_diagram_examples, list_icons, generate_diagram) to build the diagram.
+DO NOT use Draw.io tools.
+
+CRITICAL CODE RULES:
+- DO NOT use any `import` or `from ... import` statements. The environment already pre-imports all diagram providers and services.
+- Start your code immediately with `with Diagram(...):`.
+- Use the exact names from `list_icons` directly (e.g., `S3`, `Lambda`, `Glue`).
+- If you need to use Windows file paths (like the workspace_dir), you MUST use raw strings `r"C:\\path"` or replace backslashes with forward slashes `"C:/path"` to prevent unicode escape errors.
+
+WORKFLOW:
+1. Use get_diagram_examples to understand the syntax for AWS architecture diagrams.
+2. Use list_icons to find the exact names for the required AWS icons.
+3. Write the Python code and call generate_diagram. Ensure you pass workspace_dir to save it appropriately.
+Return a summary of the generated diagram and the saved file path."""
+
+_PROMPT_DRAWIO = """You are an expert diagram architect that creates professional AWS diagrams DIRECTLY in Draw.io.
+You MUST use the Draw.io MCP tools (prefixed with drawio_) to build diagrams interactively.
+Do NOT use the aws_diagram tools — the user wants Draw.io diagrams.
+
+## WORKFLOW — Create diagrams step by step:
+
+### Step 1: Create Components with drawio_add-rectangle
+Use `drawio_add-rectangle` to create each component. Use the `style` param with mxgraph styles for AWS icons.
+
+IMPORTANT: Independent shapes can be requested together — the bridge batches concurrent tool calls efficiently. Only wait for results you depend on (e.g. shape ids for edges).
+
+AWS Icon Style Guide:
+| Component | Style String |
+|-----------|-------------|
+{style_rows}
+
+Components not listed above: call get_aws_style(component) to fetch their style string. Known components: {known_components}.
+
+Grid: x increments of 200 (100, 300, 500...), y increments of 150. Icons: width=60, height=60.
+
+### Step 2: Connect with drawio_add-edge
+- source_id and target_id from Step 1
+- style: "endArrow=classic;strokeWidth=2;strokeColor=#333333;"
+
+CRITICAL: Create ALL shapes before adding edges — edges need the shape ids returned in Step 1."""
+
+def _render_drawio_prompt(message):
+    """Inline only the style rows the message mentions.
+
+    The full table cost thousands of prompt tokens per request; anything
+    not inlined is reachable through the get_aws_style tool.
+    """
+    lowered = message.lower()
+    components = [name for name in _AWS_STYLES if name.lower() in lowered]
+    if not components:
+        components = list(_DEFAULT_STYLE_COMPONENTS)
+    rows = "\n".join(f'| {name} | "{_AWS_STYLES[name]}" |' for name in components)
+    return _PROMPT_DRAWIO.format(
+        style_rows=rows,
+        known_components=", ".join(_AWS_STYLES),
+    )
+
+
+@strands_tool(
+    name="get_aws_style",
+    description="Look up the Draw.io mxgraph style string for an AWS component, e.g. 'EC2', 'S3', 'Route 53'.",
+)
+def get_aws_style(component: str) -> str:
+    """Return the mxgraph style string for an AWS component.
+
+    Args:
+        component: Component name from the known components list.
+    """
+    style = _AWS_STYLES.get(component)
+    if style is None:
+        lowered = component.strip().lower()
+        style = next((s for name, s in _AWS_STYLES.items() if name.lower() == lowered), None)
+    if style is None:
+        return json.dumps({
+            "error": f"Unknown component '{component}'",
+            "known_components": sorted(_AWS_STYLES),
+        })
+    return style
 
 
 # ── Routes ──────────────────────────────────────────────
@@ -94,65 +694,73 @@ def serialize_mcp_result(obj):
 async def health():
     return jsonify({
         'status': 'ok',
-        'mcp_connected': mcp_client is not None,
-        'tools_loaded': len(mcp_tools_cache)
+        'mcp_connected': bool(mcp_clients),
+        'servers': sorted(mcp_clients),
+        'tools_loaded': len(mcp_tools_cache),
+        'tool_calls': dict(_tool_stats)
     })
 
 
 @app.route('/tools', methods=['GET'])
 async def list_tools_route():
-    if not mcp_client:
+    if not mcp_clients:
+        return jsonify({'error': 'MCP not connected'}), 500
+    # Serve the payload cached at connect time — no MCP round-trip per GET
+    return Response(_tools_json, mimetype='application/json')
+
+
+@app.route('/tools/refresh', methods=['POST'])
+async def refresh_tools_route():
+    """Re-list tools from the MCP servers and rebuild the cached payload."""
+    if not mcp_clients:
         return jsonify({'error': 'MCP not connected'}), 500
     try:
-        tools = await mcp_client.list_tools()
-        tools_list = [
-            {
-                'name': tool.name,
-                'description': tool.description,
-                'inputSchema': tool.inputSchema
-            }
-            for tool in tools
-        ]
-        return jsonify({'tools': tools_list})
+        async with _tools_lock:
+            await _rebuild_tool_caches()
+        return jsonify({'refreshed': True, 'tools_loaded': len(mcp_tools_cache)})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
 @app.route('/call-tool', methods=['POST'])
 async def call_tool():
-    print(f"DEBUG: ENTERING /call-tool")
-    if not mcp_client:
+    if not mcp_clients:
         return jsonify({'error': 'MCP not connected'}), 500
     data = await request.json
     tool_name = data.get('name')
     arguments = data.get('arguments', {})
-    print(f"DEBUG: CALLING: {tool_name} with {str(arguments)[:200]}")
+    log.debug("CALLING: %s with %.200s", tool_name, arguments)
     if not tool_name:
         return jsonify({'error': 'Tool name required'}), 400
     try:
-        result = await asyncio.wait_for(
-            mcp_client.call_tool(tool_name, arguments),
-            timeout=120
-        )
+        result = await _call_mcp_tool_bounded(tool_name, arguments, timeout=120)
         result_data = serialize_mcp_result(result)
-        print(f"DEBUG: SUCCESS: {tool_name} -> {str(result_data)[:300]}")
-        return jsonify({'result': result_data})
+        log.debug("SUCCESS: %s -> %.300s", tool_name, result_data)
+        # orjson is ~3-5x faster than stdlib json and emits bytes directly
+        return Response(orjson.dumps({'result': result_data}), mimetype='application/json')
+    except BridgeOverloadedError as e:
+        log.warning("OVERLOADED: %s", tool_name)
+        return jsonify({'code': -32001, 'message': 'overloaded', 'error': str(e)}), 503
     except asyncio.TimeoutError:
-        print(f"DEBUG: TIMEOUT: {tool_name}")
+        log.warning("TIMEOUT: %s", tool_name)
         return jsonify({'error': f"Tool '{tool_name}' timed out"}), 504
     except Exception as e:
-        import traceback
-        tb = traceback.format_exc()
-        print(f"DEBUG: ERROR: {tool_name}\n{tb}")
-        return jsonify({'error': f"{type(e).__name__}: {str(e) or repr(e)}", 'traceback': tb}), 500
+        log.exception("Tool call failed: %s", tool_name)
+        payload = {'error': f"{type(e).__name__}: {str(e) or repr(e)}"}
+        tb = traceback.format_exc() if DEBUG_TB else ''
+        if tb:
+            payload['traceback'] = tb
+        return jsonify(payload), 500
 
 
 @app.errorhandler(500)
 async def handle_500(error):
-    import traceback
-    tb = traceback.format_exc()
-    print(f"DEBUG: GLOBAL 500 HANDLER: {type(error).__name__}: {repr(error)}\n{tb}")
-    return jsonify({'error': f"Internal: {type(error).__name__}: {str(error) or repr(error)}", "traceback": tb}), 500
+    log.exception("Global 500 handler: %r", error)
+    payload = {'error': f"Internal: {type(error).__name__}: {str(error) or repr(error)}"}
+    tb = traceback.format_exc() if DEBUG_TB else ''
+    if tb:
+        payload['traceback'] = tb
+    return jsonify(payload), 500
 
 
 @app.route('/chat', methods=['POST'])
@@ -172,183 +780,75 @@ async def chat():
         return jsonify({'error': 'apiKey is required. Set OPENAI_API_KEY or pass in request.'}), 400
 
     try:
-        from strands import Agent
-        from strands.models.openai import OpenAIModel
-        from strands import tool as strands_tool
-        import inspect
-
-        model = OpenAIModel(
-            client_args={"api_key": api_key},
-            model_id="gpt-4o",
-        )
-
-        # Build @tool-decorated functions for each MCP tool
-        # These tool functions use asyncio to call MCP in the same event loop
-        tool_list = []
-        loop = asyncio.get_event_loop()
-
-        for t in mcp_tools_cache:
-            tool_name = t.name
-            tool_desc = t.description or tool_name
-            schema = t.inputSchema if hasattr(t, 'inputSchema') else {}
-
-            def make_tool_fn(name, desc, input_schema):
-                props = input_schema.get("properties", {})
-                required_params = input_schema.get("required", [])
-
-                def tool_fn(**kwargs) -> str:
-                    """Proxy MCP tool call."""
-                    filtered = {k: v for k, v in kwargs.items() if v is not None}
-                    if name.startswith("aws_diagram") and platform.system() == "Windows":
-                        filtered["timeout"] = 0
-
-                    print(f"\n🔧 Calling tool: {name}")
-                    print(f"   Args: {json.dumps(filtered, default=str)[:200]}")
-                    try:
-                        # Use the event loop to call the async tool
-                        future = asyncio.run_coroutine_threadsafe(
-                            asyncio.wait_for(
-                                mcp_client.call_tool(name, filtered),
-                                timeout=60
-                            ),
-                            loop
-                        )
-                        result = future.result(timeout=90)
-                        serialized = serialize_mcp_result(result)
-                        result_str = json.dumps(serialized) if not isinstance(serialized, str) else serialized
-                        print(f"   ✅ Result: {result_str[:200]}")
-                        return result_str
-                    except asyncio.TimeoutError:
-                        print(f"   ⏰ TIMEOUT: Tool '{name}' timed out")
-                        return json.dumps({"error": f"Tool '{name}' timed out."})
-                    except Exception as e:
-                        print(f"   ❌ ERROR: Tool '{name}' failed: {str(e)}")
-                        return json.dumps({"error": f"Tool '{name}' failed: {str(e)}"})
-
-                # Build proper function signature
-                parameters = []
-                for pname, pinfo in props.items():
-                    json_type = pinfo.get("type", "string")
-                    if not json_type and "anyOf" in pinfo:
-                        for variant in pinfo["anyOf"]:
-                            if variant.get("type") != "null":
-                                json_type = variant.get("type", "string")
-                                break
-
-                    py_type = str
-                    if json_type == "integer":
-                        py_type = int
-                    elif json_type == "number":
-                        py_type = float
-                    elif json_type == "boolean":
-                        py_type = bool
-
-                    default = inspect.Parameter.empty if pname in required_params else None
-                    parameters.append(inspect.Parameter(
-                        pname,
-                        inspect.Parameter.POSITIONAL_OR_KEYWORD,
-                        default=default,
-                        annotation=py_type,
-                    ))
-
-                tool_fn.__signature__ = inspect.Signature(parameters, return_annotation=str)
-                tool_fn.__name__ = name
-                tool_fn.__qualname__ = name
-
-                doc_lines = [desc]
-                param_docs = []
-                for pname, pinfo in props.items():
-                    pdesc = pinfo.get("description", "")
-                    if pdesc:
-                        param_docs.append(f"    {pname}: {pdesc}")
-                if param_docs:
-                    doc_lines.append("\nArgs:")
-                    doc_lines.extend(param_docs)
-                tool_fn.__doc__ = "\n".join(doc_lines)
-
-                return strands_tool(name=name, description=desc)(tool_fn)
-
-            tool_list.append(make_tool_fn(tool_name, tool_desc, schema))
+        model = _get_model(api_key)
 
         format_choice = data.get('format', 'drawio')
 
-        # Filter tools and swap prompt based on user preference
+        # Tool proxies are prebuilt at connect time; the Draw.io prompt only
+        # inlines the style rows this message needs
         if format_choice == 'png':
-            active_tools = [t for t in tool_list if not getattr(t, '__name__', getattr(t, 'name', '')).startswith('drawio')]
-            system_prompt = """You are an expert diagram architect. The user wants a static PNG diagram generated via Python.
-You MUST use the aws_diagram tools (get_diagram_examples, list_icons, generate_diagram) to build the diagram.
-DO NOT use Draw.io tools.
-
-CRITICAL CODE RULES:
-- DO NOT use any `import` or `from ... import` statements. The environment already pre-imports all diagram providers and services.
-- Start your code immediately with `with Diagram(...):`.
-- Use the exact names from `list_icons` directly (e.g., `S3`, `Lambda`, `Glue`).
-- If you need to use Windows file paths (like the workspace_dir), you MUST use raw strings `r"C:\\path"` or replace backslashes with forward slashes `"C:/path"` to prevent unicode escape errors.
-
-WORKFLOW:
-1. Use get_diagram_examples to understand the syntax for AWS architecture diagrams.
-2. Use list_icons to find the exact names for the required AWS icons.
-3. Write the Python code and call generate_diagram. Ensure you pass workspace_dir to save it appropriately.
-Return a summary of the generated diagram and the saved file path."""
+            system_prompt = _PROMPT_PNG
+            active_tools = PREBUILT_AWS_TOOLS
         else:
-            active_tools = [t for t in tool_list if getattr(t, '__name__', getattr(t, 'name', '')).startswith('drawio')]
-            system_prompt = """You are an expert diagram architect that creates professional AWS diagrams DIRECTLY in Draw.io.
-You MUST use the Draw.io MCP tools (prefixed with drawio_) to build diagrams interactively.
-Do NOT use the aws_diagram tools — the user wants Draw.io diagrams.
-
-## WORKFLOW — Create diagrams step by step:
-
-### Step 1: Create Components with drawio_add-rectangle
-Use `drawio_add-rectangle` to create each component. Use the `style` param with mxgraph styles for AWS icons.
-
-IMPORTANT: Create shapes ONE AT A TIME. Wait for each tool call to succeed before the next.
-
-AWS Icon Style Guide:
-| Component      | Style String |
-|----------------|-------------|
-| User           | "shape=mxgraph.aws4.user;verticalLabelPosition=bottom;align=center;verticalAlign=top;html=1;fontColor=#232F3E;fillColor=#D2D3D3;strokeColor=none;aspect=fixed;" |
-| EC2            | "shape=mxgraph.aws4.resourceIcon;resIcon=mxgraph.aws4.ec2;fontColor=#232F3E;fillColor=#ED7100;strokeColor=#ffffff;verticalLabelPosition=bottom;verticalAlign=top;align=center;html=1;aspect=fixed;" |
-| RDS            | "shape=mxgraph.aws4.resourceIcon;resIcon=mxgraph.aws4.rds;fontColor=#232F3E;fillColor=#3333FF;strokeColor=#ffffff;verticalLabelPosition=bottom;verticalAlign=top;align=center;html=1;aspect=fixed;" |
-| S3             | "shape=mxgraph.aws4.resourceIcon;resIcon=mxgraph.aws4.s3;fontColor=#232F3E;fillColor=#009900;strokeColor=#ffffff;verticalLabelPosition=bottom;verticalAlign=top;align=center;html=1;aspect=fixed;" |
-| Lambda         | "shape=mxgraph.aws4.resourceIcon;resIcon=mxgraph.aws4.lambda;fontColor=#232F3E;fillColor=#ED7100;strokeColor=#ffffff;verticalLabelPosition=bottom;verticalAlign=top;align=center;html=1;aspect=fixed;" |
-| API Gateway    | "shape=mxgraph.aws4.resourceIcon;resIcon=mxgraph.aws4.api_gateway;fontColor=#232F3E;fillColor=#8C4FFF;strokeColor=#ffffff;verticalLabelPosition=bottom;verticalAlign=top;align=center;html=1;aspect=fixed;" |
-| Glue           | "shape=mxgraph.aws4.resourceIcon;resIcon=mxgraph.aws4.glue;fontColor=#232F3E;fillColor=#8C4FFF;strokeColor=#ffffff;verticalLabelPosition=bottom;verticalAlign=top;align=center;html=1;aspect=fixed;" |
-| SNS            | "shape=mxgraph.aws4.resourceIcon;resIcon=mxgraph.aws4.sns;fontColor=#232F3E;fillColor=#CC2264;strokeColor=#ffffff;verticalLabelPosition=bottom;verticalAlign=top;align=center;html=1;aspect=fixed;" |
-| SQS            | "shape=mxgraph.aws4.resourceIcon;resIcon=mxgraph.aws4.sqs;fontColor=#232F3E;fillColor=#CC2264;strokeColor=#ffffff;verticalLabelPosition=bottom;verticalAlign=top;align=center;html=1;aspect=fixed;" |
-| CloudWatch     | "shape=mxgraph.aws4.resourceIcon;resIcon=mxgraph.aws4.cloudwatch;fontColor=#232F3E;fillColor=#CC2264;strokeColor=#ffffff;verticalLabelPosition=bottom;verticalAlign=top;align=center;html=1;aspect=fixed;" |
-| DynamoDB       | "shape=mxgraph.aws4.resourceIcon;resIcon=mxgraph.aws4.dynamodb;fontColor=#232F3E;fillColor=#3333FF;strokeColor=#ffffff;verticalLabelPosition=bottom;verticalAlign=top;align=center;html=1;aspect=fixed;" |
-| Step Functions | "shape=mxgraph.aws4.resourceIcon;resIcon=mxgraph.aws4.step_functions;fontColor=#232F3E;fillColor=#CC2264;strokeColor=#ffffff;verticalLabelPosition=bottom;verticalAlign=top;align=center;html=1;aspect=fixed;" |
-| Bedrock        | "shape=mxgraph.aws4.resourceIcon;resIcon=mxgraph.aws4.bedrock;fontColor=#232F3E;fillColor=#01A88D;strokeColor=#ffffff;verticalLabelPosition=bottom;verticalAlign=top;align=center;html=1;aspect=fixed;" |
-| VPC            | "shape=mxgraph.aws4.resourceIcon;resIcon=mxgraph.aws4.vpc;fontColor=#232F3E;fillColor=#8C4FFF;strokeColor=#ffffff;verticalLabelPosition=bottom;verticalAlign=top;align=center;html=1;aspect=fixed;" |
-| Route 53       | "shape=mxgraph.aws4.resourceIcon;resIcon=mxgraph.aws4.route_53;fontColor=#232F3E;fillColor=#8C4FFF;strokeColor=#ffffff;verticalLabelPosition=bottom;verticalAlign=top;align=center;html=1;aspect=fixed;" |
-| Cognito        | "shape=mxgraph.aws4.resourceIcon;resIcon=mxgraph.aws4.cognito;fontColor=#232F3E;fillColor=#DD344C;strokeColor=#ffffff;verticalLabelPosition=bottom;verticalAlign=top;align=center;html=1;aspect=fixed;" |
-| ECS            | "shape=mxgraph.aws4.resourceIcon;resIcon=mxgraph.aws4.ecs;fontColor=#232F3E;fillColor=#ED7100;strokeColor=#ffffff;verticalLabelPosition=bottom;verticalAlign=top;align=center;html=1;aspect=fixed;" |
-| EKS            | "shape=mxgraph.aws4.resourceIcon;resIcon=mxgraph.aws4.eks;fontColor=#232F3E;fillColor=#ED7100;strokeColor=#ffffff;verticalLabelPosition=bottom;verticalAlign=top;align=center;html=1;aspect=fixed;" |
-| KMS            | "shape=mxgraph.aws4.resourceIcon;resIcon=mxgraph.aws4.kms;fontColor=#232F3E;fillColor=#DD344C;strokeColor=#ffffff;verticalLabelPosition=bottom;verticalAlign=top;align=center;html=1;aspect=fixed;" |
-| Kinesis        | "shape=mxgraph.aws4.resourceIcon;resIcon=mxgraph.aws4.kinesis;fontColor=#232F3E;fillColor=#8C4FFF;strokeColor=#ffffff;verticalLabelPosition=bottom;verticalAlign=top;align=center;html=1;aspect=fixed;" |
-| Redshift       | "shape=mxgraph.aws4.resourceIcon;resIcon=mxgraph.aws4.redshift;fontColor=#232F3E;fillColor=#3333FF;strokeColor=#ffffff;verticalLabelPosition=bottom;verticalAlign=top;align=center;html=1;aspect=fixed;" |
-
-Grid: x increments of 200 (100, 300, 500...), y increments of 150. Icons: width=60, height=60.
-
-### Step 2: Connect with drawio_add-edge
-- source_id and target_id from Step 1
-- style: "endArrow=classic;strokeWidth=2;strokeColor=#333333;"
-
-CRITICAL: Create shapes ONE AT A TIME. Never call multiple drawio tools in parallel."""
-
-        # Run agent in a thread so it doesn't block the event loop
-        def run_agent():
-            agent = Agent(model=model, system_prompt=system_prompt, tools=active_tools)
+            system_prompt = _render_drawio_prompt(message)
+            active_tools = PREBUILT_DRAWIO_TOOLS
+
+        # Run agent on the llm-worker thread so it doesn't block the event loop
+        def run_agent(callback_handler=None):
+            kwargs = {}
+            if callback_handler is not None:
+                kwargs['callback_handler'] = callback_handler
+            agent = Agent(model=model, system_prompt=system_prompt,
+                          tools=active_tools, **kwargs)
             result = agent(message)
             return str(result)
 
-        response_text = await asyncio.to_thread(run_agent)
-
-        return jsonify({'response': response_text})
+        loop = asyncio.get_running_loop()
+        wants_stream = bool(data.get('stream')) or \
+            'text/event-stream' in request.headers.get('Accept', '')
+
+        if not wants_stream:
+            async with _CHAT_SEM:
+                response_text = await _run_on_llm_worker(run_agent)
+            return jsonify({'response': response_text})
+
+        # SSE: emit tool progress as it happens, then the final response,
+        # so the client can render shapes while the agent is still working
+        events = asyncio.Queue()
+        seen_tools = set()
+
+        def on_event(**cb_kwargs):
+            tool_use = cb_kwargs.get('current_tool_use') or {}
+            tool_id = tool_use.get('toolUseId')
+            if tool_id and tool_id not in seen_tools:
+                seen_tools.add(tool_id)
+                loop.call_soon_threadsafe(
+                    events.put_nowait,
+                    ('tool_use', {'name': tool_use.get('name')})
+                )
+
+        async def run_and_finish():
+            try:
+                async with _CHAT_SEM:
+                    text = await _run_on_llm_worker(lambda: run_agent(on_event))
+                await events.put(('done', {'response': text}))
+            except Exception as e:
+                log.exception("streaming chat failed")
+                await events.put(('error', {'error': str(e)}))
+
+        async def stream_events():
+            task = loop.create_task(run_and_finish())
+            while True:
+                event, payload = await events.get()
+                yield f"event: {event}\ndata: {json.dumps(payload)}\n\n".encode()
+                if event in ('done', 'error'):
+                    break
+            await task
+
+        return Response(stream_events(), mimetype='text/event-stream')
 
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        log.exception("chat failed")
         return jsonify({'error': str(e)}), 500
 
 
@@ -360,12 +860,20 @@ async def main():
     # Initialize MCP in the SAME event loop as the web server
     await init_mcp()
 
-    print("\n📍 Routes: /health, /tools, /call-tool, /chat")
+    print("\n📍 Routes: /health, /tools, /tools/refresh, /call-tool, /chat")
     port = int(os.getenv('PORT', 8765))
     print(f"\n🌐 Starting HTTP server on http://localhost:{port}")
 
-    # Run Quart
-    await app.run_task(host='127.0.0.1', port=port)
+    # Run under hypercorn instead of Quart's dev server
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+    cfg = Config()
+    cfg.bind = [f"127.0.0.1:{port}"]
+    await serve(app, cfg)
 
 if __name__ == '__main__':
+    if platform.system() != "Windows":
+        # uvloop is POSIX-only; drops per-call event-loop overhead
+        import uvloop
+        uvloop.install()
     asyncio.run(main())
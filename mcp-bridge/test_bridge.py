@@ -34,6 +34,17 @@ def test_tools():
         print(f"   ❌ {e}")
         return False
 
+def test_tools_refresh():
+    print("\n2️⃣b Testing /tools/refresh...")
+    try:
+        r = requests.post(f"{BASE}/tools/refresh", timeout=30)
+        print(f"   Status: {r.status_code}")
+        print(f"   Body: {json.dumps(r.json())[:300]}")
+        return r.status_code == 200
+    except Exception as e:
+        print(f"   ❌ {e}")
+        return False
+
 def test_call_tool():
     print("\n3️⃣  Testing /call-tool with drawio_get-shape-categories...")
     try:
@@ -77,6 +88,7 @@ if __name__ == "__main__":
         sys.exit(1)
     
     test_tools()
+    test_tools_refresh()
     test_call_tool()
     test_add_rectangle()
     print("\n✅ All tests done.")